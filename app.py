@@ -1,7 +1,11 @@
+import json
 import os
 import pathlib
+import typing
 
-from flask import Flask
+from flask import Flask, Response
+from flask.json.provider import JSONProvider
+import orjson
 
 from blueprints.file_system_endpoints import blueprint as file_system_list_endpoint
 
@@ -20,12 +24,58 @@ def _get_root_directory() -> pathlib.Path:
     return root_directory
 
 
+def _orjson_dumps(obj: typing.Any) -> bytes:
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        # orjson refuses strings that are not valid UTF-8, such as file names that os.scandir()
+        # returns with surrogate escapes, so fall back to the standard library which escapes them.
+        return json.dumps(obj).encode()
+
+
+class _OrjsonProvider(JSONProvider):
+    """
+    A JSON provider that uses orjson, which is considerably faster than the standard library
+    for serializing large responses (such as listings of big directories).
+    """
+
+    def dumps(self, obj: typing.Any, **kwargs: typing.Any) -> str:
+        return _orjson_dumps(obj).decode()
+
+    def loads(self, s: typing.Union[str, bytes], **kwargs: typing.Any) -> typing.Any:
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            # orjson also rejects escaped lone surrogates (i.e. "\udcff"), which the standard
+            # library accepts, so let it have the final say on whether the input is valid.
+            return json.loads(s)
+
+    def response(self, *args: typing.Any, **kwargs: typing.Any) -> Response:
+        # This mirrors how jsonify() treats its arguments: a single positional argument is used
+        # as-is, several are serialized as a list, and keyword arguments as a dict.
+        if args and kwargs:
+            raise TypeError("app.json.response() takes either args or kwargs, not both")
+        obj = args[0] if len(args) == 1 else (args or kwargs or None)
+        # orjson produces bytes directly, so skip the round trip through str that dumps() needs.
+        return self._app.response_class(_orjson_dumps(obj), mimetype="application/json")
+
+
 def create_app() -> Flask:
     app = Flask(__name__)
-    app.config["root_directory"] = _get_root_directory()
+    app.json = _OrjsonProvider(app)
+    # The root directory is resolved once here so that request handlers can use it directly
+    # without paying for the readlink/stat syscalls that Path.resolve() makes on every call.
+    root_directory = _get_root_directory().resolve()
+    app.config["root_directory"] = root_directory
+    app.config["root_directory_str"] = str(root_directory)
+    # Joining with "" adds a trailing separator (unless the root is "/", which already has one), which is
+    # what the start of every path inside the root directory must match.
+    app.config["root_directory_prefix"] = os.path.join(str(root_directory), "")
     app.register_blueprint(file_system_list_endpoint)
     return app
 
 
 if __name__ == "__main__":
+    # This uses Flask's development server, which is only meant for local testing. See run_server.sh
+    # for how the app is served in production.
     create_app().run()
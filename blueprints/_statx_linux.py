@@ -0,0 +1,111 @@
+"""
+A minimal ctypes binding for the Linux statx() syscall.
+
+Directory listings only need the type, mode, owner and size of each file. statx() lets us ask for
+just those fields, and AT_STATX_DONT_SYNC allows network filesystems (such as NFS) to answer from
+their attribute cache instead of making a round trip to the server for every file.
+"""
+import ctypes
+import errno
+import os
+import sys
+from typing import NamedTuple, Optional
+
+
+_AT_FDCWD = -100
+_AT_SYMLINK_NOFOLLOW = 0x100
+_AT_STATX_DONT_SYNC = 0x4000
+
+_STATX_TYPE = 0x1
+_STATX_MODE = 0x2
+_STATX_UID = 0x8
+_STATX_SIZE = 0x200
+
+
+class _StatxTimestamp(ctypes.Structure):
+    _fields_ = [
+        ("tv_sec", ctypes.c_int64),
+        ("tv_nsec", ctypes.c_uint32),
+        ("__reserved", ctypes.c_int32),
+    ]
+
+
+class _Statx(ctypes.Structure):
+    # Mirrors "struct statx" from <linux/stat.h>, which the kernel guarantees is 256 bytes.
+    _fields_ = [
+        ("stx_mask", ctypes.c_uint32),
+        ("stx_blksize", ctypes.c_uint32),
+        ("stx_attributes", ctypes.c_uint64),
+        ("stx_nlink", ctypes.c_uint32),
+        ("stx_uid", ctypes.c_uint32),
+        ("stx_gid", ctypes.c_uint32),
+        ("stx_mode", ctypes.c_uint16),
+        ("__spare0", ctypes.c_uint16),
+        ("stx_ino", ctypes.c_uint64),
+        ("stx_size", ctypes.c_uint64),
+        ("stx_blocks", ctypes.c_uint64),
+        ("stx_attributes_mask", ctypes.c_uint64),
+        ("stx_atime", _StatxTimestamp),
+        ("stx_btime", _StatxTimestamp),
+        ("stx_ctime", _StatxTimestamp),
+        ("stx_mtime", _StatxTimestamp),
+        ("stx_rdev_major", ctypes.c_uint32),
+        ("stx_rdev_minor", ctypes.c_uint32),
+        ("stx_dev_major", ctypes.c_uint32),
+        ("stx_dev_minor", ctypes.c_uint32),
+        ("__spare2", ctypes.c_uint64 * 14),
+    ]
+
+
+class BasicStat(NamedTuple):
+    st_mode: int
+    st_uid: int
+    st_size: int
+
+
+def _load_statx():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        # glibc exposes a statx() wrapper since 2.28, which saves us from hardcoding the
+        # architecture specific syscall number.
+        statx = ctypes.CDLL(None, use_errno=True).statx
+    except (AttributeError, OSError):
+        return None
+    statx.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_uint, ctypes.POINTER(_Statx)]
+    statx.restype = ctypes.c_int
+    return statx
+
+
+_statx = _load_statx()
+
+
+def basic_lstat(path: str) -> Optional[BasicStat]:
+    """
+    Returns the mode, owner and size of the path without following a final symlink, or None if
+    statx() is not supported here or the filesystem did not return all of those fields (in which
+    case the caller should fall back to os.lstat()).
+    Raises an OSError in the same way os.lstat() does if the path can not be stat'ed.
+    """
+    global _statx
+    if _statx is None:
+        return None
+
+    result = _Statx()
+    flags = _AT_STATX_DONT_SYNC | _AT_SYMLINK_NOFOLLOW
+    mask = _STATX_TYPE | _STATX_MODE | _STATX_UID | _STATX_SIZE
+    if _statx(_AT_FDCWD, os.fsencode(path), flags, mask, ctypes.byref(result)) != 0:
+        error_number = ctypes.get_errno()
+        # Older kernels do not implement statx, and some seccomp profiles (i.e. older Docker
+        # releases) reject it, so remember that and stop trying after the first failure.
+        if error_number in (errno.ENOSYS, errno.EPERM):
+            _statx = None
+            return None
+        raise OSError(error_number, os.strerror(error_number), path)
+
+    if (result.stx_mask & mask) != mask:
+        # Some filesystems (i.e. certain FUSE and network filesystems) may not fill in every field
+        # that was asked for, and the missing ones are left as zero, so let the caller fall back.
+        return None
+
+    return BasicStat(st_mode=result.stx_mode, st_uid=result.stx_uid, st_size=result.stx_size)
@@ -1,28 +1,156 @@
 import base64
+import binascii
+from concurrent.futures import ThreadPoolExecutor
+import fcntl
+import functools
 from http import HTTPStatus
+import itertools
+import locale
 import os
-import pathlib
 from pwd import getpwuid
+import re
 import shutil
 import stat
-from typing import Dict, Union
+import sys
+import threading
+from typing import Dict, Iterator, Union
 
-from flask import Blueprint, current_app, jsonify, request
+import cachetools
+from flask import Blueprint, current_app, jsonify, request, send_file
+import orjson
+
+from blueprints._statx_linux import basic_lstat
 
 
 blueprint = Blueprint("file_system_list_endpoints", __name__, url_prefix="")
 
+# The content types that file contents can be returned as, in order of preference when the client
+# does not express one.
+_FILE_CONTENT_MIMETYPES = ["application/json", "application/octet-stream"]
+
+# Directory listings are paginated so that a single request against a huge directory can't tie up
+# a worker or build an enormous JSON response.
+_DEFAULT_PAGE_SIZE = 1000
+_MAX_PAGE_SIZE = 10000
+
+# Gathering the details of each file is dominated by blocking stat syscalls (which release the
+# GIL), so for large directories they are fanned out over a thread pool. This mostly helps on
+# network filesystems, and is skipped for small directories where the overhead isn't worth it.
+_FILE_DETAILS_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="file_details")
+_FILE_DETAILS_PARALLEL_THRESHOLD = 64
+
+# Directories that are listed repeatedly would otherwise stat every file on every request, so the
+# details of each file are cached by path for a short time. The cache is per process, so writes and
+# deletes only invalidate the cache of the worker process that handled them. Other workers (and
+# other replicas) keep serving their cached details until they expire, so the TTL is the real bound
+# on how stale a listing can be, whether the file was changed through this API or not.
+_FILE_DETAILS_CACHE: cachetools.TTLCache = cachetools.TTLCache(maxsize=4096, ttl=1.0)
+_FILE_DETAILS_CACHE_LOCK = threading.Lock()
+
+# Uploads are written to disk in chunks of this size so that large files never need to be held in
+# memory all at once. This must be a multiple of 4 so that base64 chunks decode independently.
+_WRITE_CHUNK_SIZE = 65536
+_NON_BASE64_CHARACTERS = re.compile(r"[^A-Za-z0-9+/=]")
+
+
+# stat.filemode() loops over every permission bit in Python, and oct() builds a new string, for each
+# file. Only a handful of distinct modes show up in practice, so both are looked up in tables.
+_FILEMODE_CACHE: Dict[int, str] = {}
+_PERMISSIONS_OCTAL = [f"{permissions:03o}" for permissions in range(0o1000)]
+
 
-def _get_file_details(path: pathlib.Path) -> Dict[str, Union[str, int]]:
-    root_directory = current_app.config["root_directory"].resolve()
-    file_stat = os.stat(path, follow_symlinks=False)
-    return {
-        "file_name": str(path.relative_to(root_directory)),
-        "owner": getpwuid(file_stat.st_uid).pw_name,
+def _filemode(mode: int) -> str:
+    mode &= 0xFFFF
+    filemode = _FILEMODE_CACHE.get(mode)
+    if filemode is None:
+        filemode = _FILEMODE_CACHE.setdefault(mode, stat.filemode(mode))
+    return filemode
+
+
+@functools.lru_cache(maxsize=1024)
+def _uid_to_name(uid: int) -> str:
+    # Looking up a user goes through NSS (which may read /etc/passwd or hit LDAP), and most
+    # files in a directory share the same handful of owners, so the results are cached.
+    try:
+        return getpwuid(uid).pw_name
+    except KeyError:
+        # The user that owns the file may have been deleted, so fall back to the raw uid.
+        return str(uid)
+
+
+def _get_file_details(entry: os.DirEntry, root_str: str) -> Dict[str, Union[str, int]]:
+    with _FILE_DETAILS_CACHE_LOCK:
+        file_details = _FILE_DETAILS_CACHE.get(entry.path)
+    if file_details is not None:
+        return file_details
+
+    # On Linux, statx() fetches only the fields we need and can be served from the filesystem's
+    # attribute cache. Elsewhere, DirEntry caches the result of stat(), and on some platforms it
+    # is populated for free while scanning the directory, so this avoids a syscall per entry.
+    file_stat = basic_lstat(entry.path) or entry.stat(follow_symlinks=False)
+    file_details = {
+        "file_name": os.path.relpath(entry.path, root_str),
+        "owner": _uid_to_name(file_stat.st_uid),
         "size_in_bytes": file_stat.st_size,
-        "permissions_octal": oct(file_stat.st_mode & 0o777)[-3:],
-        "permissions_human": stat.filemode(file_stat.st_mode),
+        "permissions_octal": _PERMISSIONS_OCTAL[file_stat.st_mode & 0o777],
+        "permissions_human": _filemode(file_stat.st_mode),
     }
+    with _FILE_DETAILS_CACHE_LOCK:
+        _FILE_DETAILS_CACHE[entry.path] = file_details
+    return file_details
+
+
+def _invalidate_file_details(*paths: str, recursive: bool = False) -> None:
+    # This only clears the current process's cache, so that this worker's own listings reflect the
+    # change immediately. See _FILE_DETAILS_CACHE for why other workers can still be stale.
+    with _FILE_DETAILS_CACHE_LOCK:
+        for path in paths:
+            _FILE_DETAILS_CACHE.pop(path, None)
+            if recursive:
+                # When a directory is removed, anything cached underneath it is now stale too.
+                prefix = path + os.sep
+                for cached_path in [x for x in _FILE_DETAILS_CACHE if x.startswith(prefix)]:
+                    _FILE_DETAILS_CACHE.pop(cached_path, None)
+
+
+def _read_file(path: str) -> bytes:
+    # A buffered open() issues several extra syscalls (ioctl, lseek, repeated fstat) before the
+    # first read, so the file is read directly with a buffer sized from a single fstat instead.
+    fd = os.open(path, os.O_RDONLY | os.O_CLOEXEC)
+    try:
+        size = os.fstat(fd).st_size
+        data = os.read(fd, size)
+        # A single read can return fewer bytes than requested (i.e. for very large files), so keep
+        # reading until we have everything that fstat reported.
+        while len(data) < size:
+            chunk = os.read(fd, size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+    finally:
+        os.close(fd)
+
+
+def _decode_text(data: bytes) -> str:
+    # This matches what reading the file with a text mode open() returns: it is decoded with the
+    # locale's encoding, and "\r\n" and "\r" line endings are translated to "\n".
+    return data.decode(locale.getpreferredencoding(False)).replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _decode_base64_chunks(base64_contents: str) -> Iterator[bytes]:
+    remainder = ""
+    for start in range(0, len(base64_contents), _WRITE_CHUNK_SIZE):
+        # The decoder ignores characters outside of the base64 alphabet (i.e. newlines from line
+        # wrapped base64), but they would shift the chunks out of 4 character alignment, so they
+        # are dropped before decoding.
+        chunk = remainder + _NON_BASE64_CHARACTERS.sub("", base64_contents[start : start + _WRITE_CHUNK_SIZE])
+        aligned_length = len(chunk) - len(chunk) % 4
+        yield base64.b64decode(chunk[:aligned_length])
+        remainder = chunk[aligned_length:]
+    if remainder:
+        # This is not valid base64, so let the decoder raise the same error it normally would.
+        yield base64.b64decode(remainder)
 
 
 @blueprint.route("/", defaults={"path": ""}, methods=["GET"])
@@ -32,31 +160,78 @@ def list_files(path: str):
     An endpoint for either listing the files in a directory or listing the contents of a file.
     The path used will be a relative path from the root_directory. This assumes that the file
     contents are small enough to be returned via a single JSON blob, so there is no pagination
-    to iterate over the contents.
+    to iterate over the contents. For larger files, send "Accept: application/octet-stream" to
+    have the raw file contents streamed back instead of being wrapped in JSON.
+
+    Directory listings are paginated using the "page" (starting from 0) and "page_size" query
+    parameters. The page size defaults to 1000 entries and is capped at 10000. The response's
+    "has_more" is true when there are more entries after the returned page.
 
     Status codes:
     200 - If the file or directory exists, and the contents were sucessfully returned
+    400 - If the page or page size is not an integer, the page is negative or too large, or the
+          page size is less than 1.
     403 - If the path is not inside of the root directory. This is a security measure to make sure
           the rest of the file system is not accessible.
     404 - If the file or directory is not found.
     """
-    root_directory = current_app.config["root_directory"].resolve()
-    full_file_path = (root_directory / path).resolve()
+    root_str = current_app.config["root_directory_str"]
+    full_file_path = os.path.realpath(os.path.join(root_str, path))
 
-    if full_file_path != root_directory and root_directory not in full_file_path.parents:
+    if full_file_path != root_str and not full_file_path.startswith(current_app.config["root_directory_prefix"]):
         return (
             jsonify({"message": f"Cannot access paths that are outside of the root directory: {path}"}),
             HTTPStatus.FORBIDDEN,
         )
 
-    if not full_file_path.exists():
+    # os.path.exists() and os.path.isdir() would each stat the path, so stat it once and use the
+    # result for both checks.
+    try:
+        file_stat = os.stat(full_file_path)
+    except (FileNotFoundError, NotADirectoryError):
         return jsonify({"message": f"Could not find file path {path}"}), HTTPStatus.NOT_FOUND
 
-    if full_file_path.is_dir():
-        return jsonify({"directory_contents": [_get_file_details(x) for x in full_file_path.iterdir()]})
+    if stat.S_ISDIR(file_stat.st_mode):
+        try:
+            page = int(request.args.get("page", 0))
+            page_size = min(int(request.args.get("page_size", _DEFAULT_PAGE_SIZE)), _MAX_PAGE_SIZE)
+        except ValueError:
+            return jsonify({"message": "The page and page size must be integers"}), HTTPStatus.BAD_REQUEST
+        if page < 0 or page_size < 1:
+            return (
+                jsonify({"message": "The page must be at least 0 and the page size must be at least 1"}),
+                HTTPStatus.BAD_REQUEST,
+            )
+        # islice() requires its bounds to fit in a C ssize_t, so reject pages too large to reach.
+        if (page + 1) * page_size + 1 > sys.maxsize:
+            return jsonify({"message": "The page is too large"}), HTTPStatus.BAD_REQUEST
+
+        with os.scandir(full_file_path) as entries:
+            # One extra entry is read past the end of the page so we can tell whether there are more.
+            page_entries = list(itertools.islice(entries, page * page_size, (page + 1) * page_size + 1))
+        has_more = len(page_entries) > page_size
+        del page_entries[page_size:]
+
+        if len(page_entries) > _FILE_DETAILS_PARALLEL_THRESHOLD:
+            directory_contents = list(
+                _FILE_DETAILS_EXECUTOR.map(_get_file_details, page_entries, itertools.repeat(root_str))
+            )
+        else:
+            directory_contents = [_get_file_details(entry, root_str) for entry in page_entries]
+        return jsonify(
+            {"directory_contents": directory_contents, "page": page, "page_size": page_size, "has_more": has_more}
+        )
+
+    if request.accept_mimetypes.best_match(_FILE_CONTENT_MIMETYPES) == "application/octet-stream":
+        # This lets werkzeug stream the file straight from disk (using sendfile where the WSGI
+        # server supports it) rather than reading the whole file into memory to build the JSON.
+        return send_file(full_file_path, mimetype="application/octet-stream", conditional=True, etag=True)
 
-    with full_file_path.open() as file:
-        return jsonify({"file_contents": file.read()}), HTTPStatus.OK
+    # File contents are the largest JSON responses besides directory listings, so they are encoded
+    # directly rather than going through jsonify's argument handling.
+    return current_app.response_class(
+        orjson.dumps({"file_contents": _decode_text(_read_file(full_file_path))}), mimetype="application/json"
+    )
 
 
 @blueprint.route("/", defaults={"path": ""}, methods=["POST", "PUT"])
@@ -66,49 +241,78 @@ def create_or_update_file(path: str):
     An endpoint for creating or updating the contents of a file. If directories did not already
     exist, they will automatically be created. For normal ascii payloads, it is recommended to
     pass the body through "contents". For non-ascii data (i.e. images or binary files), it is
-    recommeneded that you pass it through base64 encoded in "base64_contents" instead.
+    recommeneded that you pass it through base64 encoded in "base64_contents" instead. Large files
+    can also be uploaded as the raw request body by sending "Content-Type: application/octet-stream",
+    in which case they are streamed to disk without being held in memory.
 
     Status codes:
     200 - If the file or directory was successfully created or updated.
-    400 - If contents and base64_contents are both not specified, or if the method is POST and the
-          file already exists.
+    400 - If contents and base64_contents are both not specified, if base64_contents is not valid
+          base64, or if the method is POST and the file already exists.
     403 - If the path is not inside of the root directory. This is a security measure to make sure
           the rest of the file system is not accessible.
     """
-    root_directory = current_app.config["root_directory"].resolve()
-    full_file_path = (root_directory / path).resolve()
+    root_str = current_app.config["root_directory_str"]
+    full_file_path = os.path.realpath(os.path.join(root_str, path))
 
-    if full_file_path != root_directory and root_directory not in full_file_path.parents:
+    if full_file_path != root_str and not full_file_path.startswith(current_app.config["root_directory_prefix"]):
         return (
             jsonify({"message": f"Cannot access paths that are outside of the root directory: {path}"}),
             HTTPStatus.FORBIDDEN,
         )
 
-    if request.method == "POST" and full_file_path.exists():
+    is_raw_upload = request.mimetype == "application/octet-stream"
+    request_body = {} if is_raw_upload else (request.get_json() or {})
+    if not is_raw_upload and "contents" not in request_body and "base64_contents" not in request_body:
+        return jsonify({"message": "No file contents specified"}), HTTPStatus.BAD_REQUEST
+
+    if "base64_contents" in request_body and "contents" not in request_body:
+        # The contents are decoded once up front (without holding on to the decoded bytes) so that
+        # invalid base64 is rejected before the file is created or truncated.
+        try:
+            for _ in _decode_base64_chunks(request_body["base64_contents"]):
+                pass
+        except binascii.Error:
+            return jsonify({"message": "Invalid base64 contents"}), HTTPStatus.BAD_REQUEST
+
+    # Rather than checking whether the file exists and then opening it (which races with other
+    # requests), O_EXCL makes the kernel fail the open atomically if a POST would override a file.
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_EXCL if request.method == "POST" else 0)
+    try:
+        try:
+            fd = os.open(full_file_path, flags, 0o666)
+        except FileNotFoundError:
+            # Most writes go to directories that already exist, so the parent directories are only
+            # created (and the open retried) when the first attempt fails because they are missing.
+            os.makedirs(os.path.dirname(full_file_path), exist_ok=True)
+            fd = os.open(full_file_path, flags, 0o666)
+    except FileExistsError:
         return (
             jsonify({"message": f"Path already exists. If you want to override, please use PUT instead: {path}"}),
             HTTPStatus.BAD_REQUEST,
         )
 
-    request_body = request.get_json() or {}
-    if "contents" not in request_body and "base64_contents" not in request_body:
-        return jsonify({"message": "No file contents specified"}), HTTPStatus.BAD_REQUEST
-
-    full_file_path.parent.mkdir(exist_ok=True, parents=True)
-
-    if "contents" in request_body:
-        with full_file_path.open("w+") as file:
-            file.write(request_body["contents"])
-    elif "base64_contents" in request_body:
-        # In case you want to write binary to the file directly, this allows you
-        # to pass in a base64 encoded string which will be decoded before being
-        # written to the file. This is useful for uploading files such as
-        # images, since this endpoint requires the input contents to be an ascii
-        # string (a JSON requirement), and the normal string encoding of bytes
-        # that looks like "\x00\x00\x00\x00" would produce an output file that is
-        # improperly encoded (aka a string-escaped version of the contents).
-        with full_file_path.open("wb+") as file:
-            file.write(base64.b64decode(request_body["base64_contents"]))
+    with os.fdopen(fd, "wb") as file:
+        # Concurrent PUTs to the same file could otherwise truncate and write over each other and
+        # leave a mix of both contents behind, so writers take an exclusive lock on the file (held
+        # until it is closed) and only truncate it once they have the lock.
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.ftruncate(fd, 0)
+        if is_raw_upload:
+            shutil.copyfileobj(request.stream, file, _WRITE_CHUNK_SIZE)
+        elif "contents" in request_body:
+            file.write(request_body["contents"].encode())
+        elif "base64_contents" in request_body:
+            # In case you want to write binary to the file directly, this allows you
+            # to pass in a base64 encoded string which will be decoded before being
+            # written to the file. This is useful for uploading files such as
+            # images, since this endpoint requires the input contents to be an ascii
+            # string (a JSON requirement), and the normal string encoding of bytes
+            # that looks like "\x00\x00\x00\x00" would produce an output file that is
+            # improperly encoded (aka a string-escaped version of the contents).
+            for decoded_chunk in _decode_base64_chunks(request_body["base64_contents"]):
+                file.write(decoded_chunk)
+    _invalidate_file_details(full_file_path)
     return jsonify({"message": f"Created file {path}"}), HTTPStatus.OK
 
 
@@ -124,30 +328,35 @@ def delete_file(path: str):
           the rest of the file system is not accessible.
     404 - If the file or directory is not found.
     """
-    root_directory = current_app.config["root_directory"].resolve()
-    full_file_path = (root_directory / path).resolve()
+    root_str = current_app.config["root_directory_str"]
+    full_file_path = os.path.realpath(os.path.join(root_str, path))
 
-    if full_file_path != root_directory and root_directory not in full_file_path.parents:
+    if full_file_path != root_str and not full_file_path.startswith(current_app.config["root_directory_prefix"]):
         return (
             jsonify({"message": f"Cannot delete paths that are outside of the root directory: {path}"}),
             HTTPStatus.FORBIDDEN,
         )
 
-    if not full_file_path.exists():
+    # Since os.path.realpath() computes both relative paths (i.e. "..") and follows symlinks,
+    # and since we only want to remove the source of the symlink, not the destination, the
+    # raw path is inspected with a single lstat() which does not follow the final symlink.
+    raw_file_path = os.path.join(root_str, path)
+    try:
+        file_stat = os.lstat(raw_file_path)
+    except (FileNotFoundError, NotADirectoryError):
         return jsonify({"message": f"Could not find file path {path}"}), HTTPStatus.NOT_FOUND
 
-    # Since Path.resolve() computes both relative paths (i.e. "..") and follows symlinks,
-    # and since we only want to remove the source of the symlink, not the destination, we
-    # need to check if the raw path is a symlink, and if so, use that instead of the resolved
-    # path.
-    full_file_path_or_link_source = (root_directory / path) if (root_directory / path).is_symlink() else full_file_path
-
-    if full_file_path_or_link_source.is_dir():
-        shutil.rmtree(full_file_path_or_link_source)
+    if stat.S_ISDIR(file_stat.st_mode):
+        shutil.rmtree(raw_file_path)
+        _invalidate_file_details(full_file_path, recursive=True)
         return jsonify({"message": f"Deleted directory {path}"}), HTTPStatus.OK
 
     # In the unlikely case that 2 concurrent requests delete the file at the same time, we allow
     # the file to be missing here since it must have existed a few lines before, and the file not
     # existing at this point is not an issue.
-    full_file_path_or_link_source.unlink(missing_ok=True)
+    try:
+        os.unlink(raw_file_path)
+    except FileNotFoundError:
+        pass
+    _invalidate_file_details(full_file_path, os.path.normpath(raw_file_path))
     return jsonify({"message": f"Deleted file {path}"}), HTTPStatus.OK
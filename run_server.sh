@@ -1,5 +1,14 @@
 #!/bin/sh
 
 # This runs the app through a wsgi server (Gunicorn) which is preferred for production environments.
+#
+# Requests spend most of their time blocked on file system syscalls, so each worker process runs
+# several threads to keep serving other requests while one is waiting on the disk. Threads are used
+# rather than an async worker (such as gevent) because file system calls can't be made cooperative,
+# and would block every other request in the worker.
+#
+# Each worker process is a full copy of the app (with its own file details thread pool and cache), so
+# the defaults favor threads over processes to stay within the memory and CPU limits set in
+# helm-charts/values.yaml (256Mi and 200m per pod).
 
-gunicorn --bind 0.0.0.0:8000 "app:create_app()"
+gunicorn --bind 0.0.0.0:8000 --worker-class gthread --workers "${GUNICORN_WORKERS:-2}" --threads "${GUNICORN_THREADS:-16}" "app:create_app()"
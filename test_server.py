@@ -1,4 +1,5 @@
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
 import os
 from pathlib import Path
@@ -8,6 +9,7 @@ from typing import Iterable
 import pytest
 
 from app import create_app
+from blueprints import _statx_linux
 
 
 @pytest.fixture
@@ -19,7 +21,9 @@ def root_directory() -> Iterable[Path]:
 @pytest.fixture
 def test_client(root_directory):
     app = create_app()
-    app.config["root_directory"] = root_directory
+    app.config["root_directory"] = root_directory.resolve()
+    app.config["root_directory_str"] = str(root_directory.resolve())
+    app.config["root_directory_prefix"] = os.path.join(str(root_directory.resolve()), "")
     return app.test_client()
 
 
@@ -37,10 +41,18 @@ def test_get_non_existant_file_returns_404(test_client):
     assert response.json == {"message": f"Could not find file path {file_name}"}
 
 
+def test_get_path_under_a_file_returns_404(test_client, root_directory):
+    (root_directory / "foo.txt").touch()
+    file_name = "foo.txt/bar.txt"
+    response = test_client.get(f"/{file_name}")
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    assert response.json == {"message": f"Could not find file path {file_name}"}
+
+
 def test_get_empty_directory_returns_empty_list(test_client):
     response = test_client.get("/")
     assert response.status_code == HTTPStatus.OK
-    assert response.json == {"directory_contents": []}
+    assert response.json == {"directory_contents": [], "page": 0, "page_size": 1000, "has_more": False}
 
 
 def test_get_directory_returns_list_of_files(test_client, root_directory):
@@ -73,9 +85,107 @@ def test_get_directory_returns_list_of_files(test_client, root_directory):
                 "permissions_human": "-rw-r--r--",
             },
         ],
+        "page": 0,
+        "page_size": 1000,
+        "has_more": False,
     }
 
 
+def test_get_directory_pads_low_octal_permissions(test_client, root_directory):
+    file_path = root_directory / "foo.txt"
+    file_path.touch()
+    os.chmod(file_path, 0o007)
+
+    response = test_client.get("/")
+    assert response.status_code == HTTPStatus.OK
+    [file_details] = response.json["directory_contents"]
+    assert file_details["permissions_octal"] == "007"
+    assert file_details["permissions_human"] == "-------rwx"
+
+
+def test_get_directory_with_non_utf8_file_name_returns_list_of_files(test_client, root_directory):
+    file_name = os.fsdecode(b"bad\xff.txt")
+    (root_directory / file_name).touch()
+
+    response = test_client.get("/")
+    assert response.status_code == HTTPStatus.OK
+    assert [details["file_name"] for details in response.json["directory_contents"]] == [file_name]
+
+
+def test_get_directory_with_page_returns_subset_of_files(test_client, root_directory):
+    file_names = [f"file{i}.txt" for i in range(5)]
+    for file_name in file_names:
+        (root_directory / file_name).touch()
+
+    listed_file_names = []
+    for page in range(3):
+        response = test_client.get(f"/?page={page}&page_size=2")
+        assert response.status_code == HTTPStatus.OK
+        assert response.json["page"] == page
+        assert response.json["page_size"] == 2
+        assert response.json["has_more"] == (page < 2)
+        listed_file_names.extend(details["file_name"] for details in response.json["directory_contents"])
+
+    assert len(listed_file_names) == len(file_names)
+    assert sorted(listed_file_names) == sorted(file_names)
+
+
+def test_get_directory_with_exactly_a_full_last_page_has_no_more(test_client, root_directory):
+    for i in range(4):
+        (root_directory / f"file{i}.txt").touch()
+
+    response = test_client.get("/?page=1&page_size=2")
+    assert response.status_code == HTTPStatus.OK
+    assert len(response.json["directory_contents"]) == 2
+    assert response.json["has_more"] is False
+
+
+def test_get_large_directory_returns_all_files(test_client, root_directory):
+    # This is large enough that the file details are gathered in parallel.
+    file_names = [f"file{i}.txt" for i in range(200)]
+    for file_name in file_names:
+        (root_directory / file_name).touch()
+
+    response = test_client.get("/")
+    assert response.status_code == HTTPStatus.OK
+    assert sorted(details["file_name"] for details in response.json["directory_contents"]) == sorted(file_names)
+
+
+def test_get_directory_with_invalid_page_returns_bad_request(test_client):
+    response = test_client.get("/?page=-1")
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json == {"message": "The page must be at least 0 and the page size must be at least 1"}
+
+
+def test_get_directory_with_huge_page_returns_bad_request(test_client):
+    response = test_client.get("/?page=99999999999999999999")
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json == {"message": "The page is too large"}
+
+
+def test_get_directory_with_non_integer_page_returns_bad_request(test_client):
+    response = test_client.get("/?page=abc")
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+    assert response.json == {"message": "The page and page size must be integers"}
+
+
+def test_statx_basic_lstat_matches_os_lstat(root_directory):
+    file_path = root_directory / "foo.txt"
+    file_path.write_text("some file contents")
+    link_path = root_directory / "foo_link.txt"
+    os.symlink(file_path, link_path)
+
+    for path in (root_directory, file_path, link_path):
+        basic_stat = _statx_linux.basic_lstat(str(path))
+        if basic_stat is None:
+            pytest.skip("statx is not supported on this platform")
+        expected_stat = os.lstat(path)
+        assert basic_stat == (expected_stat.st_mode, expected_stat.st_uid, expected_stat.st_size)
+
+    with pytest.raises(FileNotFoundError):
+        _statx_linux.basic_lstat(str(root_directory / "does-not-exist.txt"))
+
+
 def test_get_file_returns_file_contents(test_client, root_directory):
     file_name = "foo.txt"
     file_contents = "some file contents"
@@ -86,6 +196,26 @@ def test_get_file_returns_file_contents(test_client, root_directory):
     assert response.json == {"file_contents": file_contents}
 
 
+def test_get_file_translates_line_endings_in_file_contents(test_client, root_directory):
+    file_name = "foo.txt"
+    with open(root_directory / file_name, "wb+") as file:
+        file.write(b"a\r\nb\rc\n")
+    response = test_client.get(f"/{file_name}")
+    assert response.status_code == HTTPStatus.OK
+    assert response.json == {"file_contents": "a\nb\nc\n"}
+
+
+def test_get_file_with_octet_stream_accept_returns_raw_file_contents(test_client, root_directory):
+    file_name = "foo.bin"
+    file_contents = b"\x00\x01some file contents"
+    with open(root_directory / file_name, "wb+") as file:
+        file.write(file_contents)
+    response = test_client.get(f"/{file_name}", headers={"Accept": "application/octet-stream"})
+    assert response.status_code == HTTPStatus.OK
+    assert response.mimetype == "application/octet-stream"
+    assert response.data == file_contents
+
+
 def test_post_path_outside_of_root_returns_forbidden(test_client, root_directory):
     illegal_path = "../some_file.txt"
     response = test_client.post(f"/{illegal_path}", json={"contents": "contents"})
@@ -111,6 +241,21 @@ def test_post_existing_file_returns_bad_request(test_client, root_directory):
     assert full_file_path.read_text() == file_contents
 
 
+def test_concurrent_posts_only_create_the_file_once(test_client, root_directory):
+    file_name = "foo.txt"
+
+    def post_file(index: int) -> int:
+        return test_client.post(f"/{file_name}", json={"contents": f"contents {index}"}).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        status_codes = list(executor.map(post_file, range(16)))
+
+    assert status_codes.count(HTTPStatus.OK) == 1
+    assert status_codes.count(HTTPStatus.BAD_REQUEST) == 15
+    winning_index = status_codes.index(HTTPStatus.OK)
+    assert (root_directory / file_name).read_text() == f"contents {winning_index}"
+
+
 def test_post_new_file_without_contents_returns_bad_request(test_client, root_directory):
     file_name = "foo.txt"
     response = test_client.post(f"/{file_name}", json={})
@@ -146,6 +291,51 @@ def test_post_new_file_creates_file_with_base64_contents(test_client, root_direc
     assert full_file_path.read_bytes() == file_contents
 
 
+def test_post_new_file_creates_file_with_large_line_wrapped_base64_contents(test_client, root_directory):
+    file_name = "foo.bin"
+    file_contents = bytes(range(256)) * 1000
+    base64_contents = base64.encodebytes(file_contents).decode("utf-8")
+    response = test_client.post(f"/{file_name}", json={"base64_contents": base64_contents})
+    assert response.json == {"message": f"Created file {file_name}"}
+    assert response.status_code == HTTPStatus.OK
+
+    full_file_path = root_directory / file_name
+    assert full_file_path.read_bytes() == file_contents
+
+
+def test_post_new_file_ignores_non_base64_characters_in_base64_contents(test_client, root_directory):
+    file_name = "foo.txt"
+    response = test_client.post(f"/{file_name}", json={"base64_contents": "aGV!sbG8gd29ybGQhIQ=="})
+    assert response.json == {"message": f"Created file {file_name}"}
+    assert response.status_code == HTTPStatus.OK
+
+    full_file_path = root_directory / file_name
+    assert full_file_path.read_bytes() == b"hello world!!"
+
+
+def test_post_new_file_with_invalid_base64_contents_returns_bad_request(test_client, root_directory):
+    file_name = "foo.txt"
+    response = test_client.post(f"/{file_name}", json={"base64_contents": "aGVsbG8"})
+    assert response.json == {"message": "Invalid base64 contents"}
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    full_file_path = root_directory / file_name
+    assert not full_file_path.exists()
+
+
+def test_post_new_file_creates_file_with_raw_body(test_client, root_directory):
+    file_name = "foo.bin"
+    file_contents = bytes(range(256)) * 1000
+    response = test_client.post(
+        f"/{file_name}", data=file_contents, headers={"Content-Type": "application/octet-stream"}
+    )
+    assert response.json == {"message": f"Created file {file_name}"}
+    assert response.status_code == HTTPStatus.OK
+
+    full_file_path = root_directory / file_name
+    assert full_file_path.read_bytes() == file_contents
+
+
 def test_put_new_file_creates_file_with_contents(test_client, root_directory):
     file_name = "foo.txt"
     file_contents = "foo contents"
@@ -174,6 +364,39 @@ def test_put_existing_file_updates_file_with_contents(test_client, root_director
     assert full_file_path.read_text() == updated_file_contents
 
 
+def test_get_directory_after_put_returns_updated_file_size(test_client):
+    # The test client runs in a single process, so this only covers invalidating that process's
+    # cache. Other worker processes can still return the old size until the cache TTL expires.
+    file_name = "foo.txt"
+    file_contents = "foo contents"
+    updated_file_contents = "updated foo contents"
+    test_client.post(f"/{file_name}", json={"contents": file_contents})
+    response = test_client.get("/")
+    assert response.json["directory_contents"][0]["size_in_bytes"] == len(file_contents)
+
+    test_client.put(f"/{file_name}", json={"contents": updated_file_contents})
+    response = test_client.get("/")
+    assert response.json["directory_contents"][0]["size_in_bytes"] == len(updated_file_contents)
+
+
+def test_concurrent_puts_leave_exactly_one_of_the_contents(test_client, root_directory):
+    file_name = "foo.bin"
+    # The payloads have different lengths, so if two writers overlapped, the longer one would leave a
+    # leftover tail behind the shorter one.
+    payloads = [bytes([index]) * (1 << (10 + 2 * index)) for index in range(6)]
+
+    def put_file(payload: bytes) -> int:
+        return test_client.put(
+            f"/{file_name}", data=payload, headers={"Content-Type": "application/octet-stream"}
+        ).status_code
+
+    for _ in range(10):
+        with ThreadPoolExecutor(max_workers=len(payloads)) as executor:
+            status_codes = list(executor.map(put_file, payloads * 2))
+        assert status_codes == [HTTPStatus.OK] * len(payloads) * 2
+        assert (root_directory / file_name).read_bytes() in payloads
+
+
 def test_delete_file_deletes_the_file(test_client, root_directory):
     file_name = "foo.txt"
     file_contents = "foo contents"
@@ -207,6 +430,26 @@ def test_delete_file_deletes_a_symlink_but_not_source_file(test_client, root_dir
     assert full_source_path.exists()
 
 
+def test_delete_file_deletes_a_symlinked_directory_but_not_source_directory(test_client, root_directory):
+    directory_name = "my_dir"
+    file_name = "foo.txt"
+    file_contents = "foo contents"
+    full_source_path = root_directory / directory_name
+    # create the source directory
+    test_client.post(f"/{directory_name}/{file_name}", json={"contents": file_contents})
+
+    link_directory_name = "my_dir_link"
+    full_link_path = root_directory / link_directory_name
+    os.symlink(full_source_path, full_link_path)
+    # delete the link
+    response = test_client.delete(f"/{link_directory_name}")
+    assert response.json == {"message": f"Deleted file {link_directory_name}"}
+    assert response.status_code == HTTPStatus.OK
+
+    assert not full_link_path.is_symlink()
+    assert (full_source_path / file_name).exists()
+
+
 def test_delete_file_deletes_a_directory(test_client, root_directory):
     directory_name = "my_dir"
     file_name = "foo.txt"